@@ -0,0 +1,215 @@
+import threading
+import time
+from threading import Thread
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+LAYER_NAMES = ("background", "video", "drawing", "overlay")  # Bottom to top
+BLEND_MODES = ("normal", "add", "multiply", "screen", "lighten")
+
+class Layer:
+    def __init__(self, name: str, num_leds: int):
+        self.name = name
+        self.rgb = np.zeros((num_leds, 3), dtype=np.float32)  # 0..1 per channel
+        self.alpha = np.zeros(num_leds, dtype=np.float32)  # 1 where this layer has a pixel
+        self.opacity = 1.0
+        self.blend = "normal"
+        self.visible = True
+
+    def info(self) -> dict:
+        return {
+            "name": self.name,
+            "opacity": self.opacity,
+            "blend": self.blend,
+            "visible": self.visible,
+            "pixels_set": int(np.count_nonzero(self.alpha)),
+        }
+
+def _blend(mode: str, dst: np.ndarray, src: np.ndarray) -> np.ndarray:
+    """Blend a layer's colors onto what is already below it"""
+    if mode == "add":
+        return np.minimum(dst + src, 1.0)
+    if mode == "multiply":
+        return dst * src
+    if mode == "screen":
+        return 1.0 - (1.0 - dst) * (1.0 - src)
+    if mode == "lighten":
+        return np.maximum(dst, src)
+    return src
+
+class Compositor:
+    """Stack of named layers flattened into one frame for the serial output.
+
+    Writers only touch their own layer; a single tick per frame recomposites
+    from the lowest layer changed since the last tick and sends the pixels
+    that differ from what the wall is already showing.
+    """
+
+    def __init__(self, num_leds: int, fps: float, send: Callable[[list], bool], ready: Callable[[], bool],
+                 layer_names=LAYER_NAMES):
+        self.num_leds = num_leds
+        self.fps = fps
+        self.send = send  # Writes [index, r, g, b] updates to the wall
+        self.ready = ready  # True once there is a device to send to
+        self.layers = [Layer(name, num_leds) for name in layer_names]
+        self.by_name = {layer.name: layer for layer in self.layers}
+        # below[k] holds the composite of layers 0..k-1, so a change on layer k
+        # only recomposites layers k and up
+        self.below = [np.zeros((num_leds, 3), dtype=np.float32) for _ in range(len(self.layers) + 1)]
+        self.dirty_from: Optional[int] = None
+        self.sent = np.zeros((num_leds, 3), dtype=np.uint8)  # What the wall currently shows
+        self.sent_gen = 0  # Bumped when the wall is written outside the compositor
+        self.lock = threading.Lock()
+        self.paused = False
+        self.frames_sent = 0
+        self._thread: Optional[Thread] = None
+        self._stop = threading.Event()
+
+    def _layer(self, name: str) -> Tuple[int, Layer]:
+        layer = self.by_name.get(name)
+        if layer is None:
+            raise KeyError(f"Unknown layer '{name}'")
+        return self.layers.index(layer), layer
+
+    def _mark_dirty(self, k: int):
+        # Note: Caller must hold self.lock
+        if self.dirty_from is None or k < self.dirty_from:
+            self.dirty_from = k
+
+    def set_pixels(self, name: str, pixels: list):
+        """Write [index, r, g, b] entries into a layer"""
+        k, layer = self._layer(name)
+        if not pixels:
+            return
+        arr = np.asarray(pixels, dtype=np.int64).reshape(-1, 4)
+        idx = arr[:, 0]
+        if idx.min() < 0 or idx.max() >= self.num_leds:
+            raise ValueError(f"LED index out of range 0..{self.num_leds - 1}")
+        rgb = np.clip(arr[:, 1:], 0, 255).astype(np.float32) / 255.0
+        with self.lock:
+            layer.rgb[idx] = rgb
+            layer.alpha[idx] = 1.0
+            self._mark_dirty(k)
+
+    def fill(self, name: str, r: int, g: int, b: int):
+        """Cover a whole layer with one color"""
+        k, layer = self._layer(name)
+        rgb = np.clip([r, g, b], 0, 255).astype(np.float32) / 255.0
+        with self.lock:
+            layer.rgb[:] = rgb
+            layer.alpha[:] = 1.0
+            self._mark_dirty(k)
+
+    def clear_layer(self, name: str):
+        """Make a layer fully transparent"""
+        k, layer = self._layer(name)
+        with self.lock:
+            layer.alpha[:] = 0.0
+            self._mark_dirty(k)
+
+    def configure(self, name: str, opacity: Optional[float] = None, blend: Optional[str] = None,
+                  visible: Optional[bool] = None):
+        """Change how a layer is combined with the layers below it"""
+        if blend is not None and blend not in BLEND_MODES:
+            raise ValueError(f"Unknown blend mode '{blend}', expected one of {', '.join(BLEND_MODES)}")
+        k, layer = self._layer(name)
+        with self.lock:
+            if opacity is not None:
+                layer.opacity = float(np.clip(opacity, 0.0, 1.0))
+            if blend is not None:
+                layer.blend = blend
+            if visible is not None:
+                layer.visible = visible
+            self._mark_dirty(k)
+
+    def layer_info(self) -> list:
+        with self.lock:
+            return [layer.info() for layer in self.layers]
+
+    def clear_all_layers(self):
+        """Make every layer fully transparent"""
+        with self.lock:
+            for layer in self.layers:
+                layer.alpha[:] = 0.0
+            self._mark_dirty(0)
+
+    def resume(self):
+        """Restart output after mapping and redraw the layers over whatever mapping left on the wall"""
+        with self.lock:
+            self.paused = False
+            self._mark_dirty(0)
+
+    def device_state(self, r: int, g: int, b: int):
+        """Record a color written to the whole wall outside the compositor (e.g. CLEAR or ALL).
+
+        Nothing is marked dirty: the wall keeps showing that color until a
+        layer changes, and only then is the difference sent.
+        """
+        with self.lock:
+            self.sent[:] = (r, g, b)
+            self.sent_gen += 1
+
+    def _composite(self) -> Optional[np.ndarray]:
+        # Note: Caller must hold self.lock
+        if self.dirty_from is None:
+            return None
+        for k in range(self.dirty_from, len(self.layers)):
+            layer = self.layers[k]
+            dst = self.below[k]
+            if not layer.visible or layer.opacity <= 0.0:
+                self.below[k + 1] = dst
+                continue
+            a = (layer.alpha * layer.opacity)[:, None]
+            self.below[k + 1] = dst + (_blend(layer.blend, dst, layer.rgb) - dst) * a
+        self.dirty_from = None
+        return np.rint(self.below[-1] * 255.0).astype(np.uint8)
+
+    def tick(self) -> int:
+        """Composite changed layers and send differing pixels; returns the number sent"""
+        if self.paused or not self.ready():
+            return 0  # Mapping owns the wall, or nothing to send to yet
+        with self.lock:
+            frame = self._composite()
+            if frame is None:
+                return 0
+            changed = np.flatnonzero(np.any(frame != self.sent, axis=1))
+            if len(changed) == 0:
+                return 0
+            updates = [[int(i), *map(int, frame[i])] for i in changed]
+            gen = self.sent_gen
+        if not self.send(updates):
+            with self.lock:
+                self._mark_dirty(len(self.layers))  # Retry on the next tick
+            return 0
+        with self.lock:
+            if self.sent_gen != gen:
+                # device_state() ran during the send; diff against its record next tick
+                self._mark_dirty(len(self.layers))
+                return 0
+            self.sent[changed] = frame[changed]
+            self.frames_sent += 1
+        return len(changed)
+
+    def _run(self):
+        period = 1.0 / max(self.fps, 1.0)
+        while not self._stop.is_set():
+            start = time.time()
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Compositor tick error: {e}")
+            self._stop.wait(max(0.0, period - (time.time() - start)))
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=1.0)
+            self._thread = None
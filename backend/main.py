@@ -1,9 +1,12 @@
-import json, os, time, threading
+import time
+_T0 = time.perf_counter()  # Reference point for the startup timing report
+
+import json, os, threading
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from threading import Thread
 from typing import List, Tuple, Optional
 
-import cv2
-import numpy as np
 from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -11,6 +14,10 @@ from pydantic import BaseModel
 import serial
 from serial.tools import list_ports
 
+# OpenCV, NumPy and the vision helpers are only needed for mapping and are
+# imported by _load_vision() on first use
+cv2 = np = vision = None
+
 # ------------------ Config ------------------
 CAM_INDEX = int(os.getenv("CAM_INDEX", "0"))
 NUM_LEDS = int(os.getenv("NUM_LEDS", "610"))  # Default 610 LEDs for the LED wall
@@ -21,6 +28,19 @@ MIN_BRIGHTNESS = float(os.getenv("MIN_BRIGHTNESS", "0.1"))  # 10%
 MAX_BRIGHTNESS = float(os.getenv("MAX_BRIGHTNESS", "1.0"))  # 100%
 SETTLE_MS = int(os.getenv("SETTLE_MS", "50"))  # Time for LED to settle
 TOLERANCE = int(os.getenv("TOLERANCE", "2"))  # intensity wiggle room
+COMPOSITOR_FPS = float(os.getenv("COMPOSITOR_FPS", "30"))  # Frames pushed to the wall per second
+
+# Mapping camera profile - unset values leave the camera's own setting
+CAMERA_PROFILE_ENV = {
+    "exposure": os.getenv("CAM_EXPOSURE"),  # Backend units; disables auto exposure
+    "gain": os.getenv("CAM_GAIN"),
+    "wb_temperature": os.getenv("CAM_WB_TEMPERATURE"),  # Kelvin; disables auto white balance
+    "width": os.getenv("CAM_WIDTH"),
+    "height": os.getenv("CAM_HEIGHT"),
+    "fps": os.getenv("CAM_FPS"),
+    "fourcc": os.getenv("CAM_FOURCC"),  # e.g. MJPG
+    "hw_roi": os.getenv("CAM_HW_ROI"),  # Crop on the sensor where the backend supports it
+}
 
 # --------------- Status (for live dots) -----
 STATUS = {
@@ -34,6 +54,9 @@ STATUS = {
     "total_leds": 0,  # Dynamic - discovered during mapping
     "consecutive_failures": 0,
     "adaptive_mode": True,
+    "cameras": None,  # Camera indexes of a multi-view run
+    "camera_index": None,  # Camera of a single-camera run, reused by /resume_mapping
+    "camera_profile": [],  # One profile report per camera, set once applied
 }
 STATUS_LOCK = threading.Lock()
 
@@ -49,7 +72,10 @@ def status_reset():
         "current_led": -1,
         "total_leds": 0,
         "consecutive_failures": 0,
-        "adaptive_mode": True
+        "adaptive_mode": True,
+        "cameras": None,  # Camera indexes of a multi-view run
+    "camera_index": None,  # Camera of a single-camera run, reused by /resume_mapping
+        "camera_profile": [],  # One profile report per camera, set once applied
     })
 
 def status_update(**kwargs):
@@ -67,6 +93,7 @@ class SerialManager:
         self.baud = baud
         self.ser: Optional[serial.Serial] = None
         self.lock = threading.Lock()
+        self.connect_lock = threading.Lock()  # One port open at a time (startup warm-up, requests, writers)
         self.connected = False
 
     def autodetect(self) -> Optional[str]:
@@ -88,7 +115,18 @@ class SerialManager:
         return None
 
     def connect(self, port: Optional[str] = None, baud: Optional[int] = None) -> bool:
-        """Connect to serial device"""
+        """Connect to serial device, reopening the port if it is already open"""
+        with self.connect_lock:
+            return self._open(port, baud)
+
+    def ensure_open(self) -> bool:
+        """Connect unless already connected; waits for a connect in progress"""
+        if self.is_open():
+            return True
+        with self.connect_lock:
+            return self.is_open() or self._open()
+
+    def _open(self, port: Optional[str] = None, baud: Optional[int] = None) -> bool:
         port = port or self.port or self.autodetect()
         baud = baud or self.baud
         if not port:
@@ -127,9 +165,8 @@ class SerialManager:
 
     def send_command(self, command: str) -> bool:
         """Send a command to the Arduino using its protocol format"""
-        if not self.is_open():
-            if not self.connect():
-                return False
+        if not self.ensure_open():
+            return False
         
         # Arduino expects commands like "PIXEL:0,255,0,0\n"
         if not command.endswith('\n'):
@@ -153,9 +190,8 @@ class SerialManager:
     
     def set_pixel_fast(self, index: int, r: int, g: int, b: int) -> bool:
         """Set a single pixel without waiting for response - for fast drawing"""
-        if not self.is_open():
-            if not self.connect():
-                return False
+        if not self.ensure_open():
+            return False
         
         cmd = f"PIXEL:{index},{r},{g},{b}\n"
         
@@ -173,9 +209,8 @@ class SerialManager:
     
     def set_pixels_batch(self, pixel_updates: list) -> bool:
         """Set multiple pixels in a batch for better performance"""
-        if not self.is_open():
-            if not self.connect():
-                return False
+        if not self.ensure_open():
+            return False
         
         with self.lock:
             try:
@@ -194,9 +229,8 @@ class SerialManager:
     
     def set_pixels_batch(self, pixels: list) -> bool:
         """Set multiple pixels using individual PIXEL commands"""
-        if not self.is_open():
-            if not self.connect():
-                return False
+        if not self.ensure_open():
+            return False
         
         with self.lock:
             try:
@@ -245,6 +279,117 @@ class SerialManager:
 
 sm = SerialManager(default_port=SERIAL_PORT_ENV, baud=BAUD)
 
+# --------------- Subsystems -----------------
+# Heavy subsystems start on first use; serial connects in the background at
+# app startup so the first device request does not pay for autodetect
+STARTUP = {
+    "import_ms": None,  # Importing this module, set at the end of the file
+    "app_ready_ms": None,  # Until the app startup event, from the same reference
+    "subsystems": {
+        "serial": {"state": "idle"},
+        "vision": {"state": "not loaded"},
+        "compositor": {"state": "not loaded"},
+    },
+}
+SUBSYSTEM_LOCK = threading.Lock()
+compositor = None  # Created by _get_compositor() on first drawing use
+_wall_color = (0, 0, 0)  # Last whole-wall colour written with CLEAR/ALL, kept while the compositor is unloaded
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+def _load_vision():
+    """Import OpenCV, NumPy and the vision helpers on first mapping use"""
+    global cv2, np, vision
+    with SUBSYSTEM_LOCK:
+        if vision is not None:
+            return
+        start = time.perf_counter()
+        import cv2 as _cv2
+        import numpy as _np
+        import vision as _vision
+        cv2, np, vision = _cv2, _np, _vision
+        STARTUP["subsystems"]["vision"] = {"state": "ready", "ms": _elapsed_ms(start)}
+    print(f"📷 Vision loaded in {STARTUP['subsystems']['vision']['ms']} ms")
+
+def _get_compositor():
+    """Create and start the compositor on first drawing use"""
+    global compositor
+    with SUBSYSTEM_LOCK:
+        if compositor is None:
+            start = time.perf_counter()
+            from compositing import Compositor
+            comp = Compositor(NUM_LEDS, COMPOSITOR_FPS, send=sm.set_pixels_batch, ready=sm.is_open)
+            comp.paused = bool(STATUS.get("running"))  # Mapping may already own the wall
+            # Start from what the wall shows, not from black
+            if _wall_color != (0, 0, 0):
+                comp.fill("background", *_wall_color)
+            comp.device_state(*_wall_color)
+            comp.start()
+            compositor = comp
+            STARTUP["subsystems"]["compositor"] = {"state": "ready", "ms": _elapsed_ms(start)}
+    return compositor
+
+def _set_wall_color(r: int, g: int, b: int):
+    """Record a colour written to the whole wall with CLEAR/ALL"""
+    global _wall_color
+    with SUBSYSTEM_LOCK:
+        _wall_color = (r, g, b)
+        if compositor is not None:
+            compositor.device_state(r, g, b)
+
+def _vision_ready() -> bool:
+    """Load vision for a mapping worker; on failure end the run with an error status"""
+    try:
+        _load_vision()
+        return True
+    except Exception as e:
+        print(f"❌ Failed to load vision: {e}")
+        STARTUP["subsystems"]["vision"] = {"state": "error", "error": str(e)}
+        status_update(running=False, done=True, status="error", message=f"Camera/vision support failed to load: {e}")
+        return False
+
+def _pause_compositor(paused: bool):
+    """Hold compositor output while mapping drives LEDs directly.
+
+    Un-pausing redraws the layers straight away, so a drawing that was on
+    the wall before mapping comes back when mapping ends.
+    """
+    if compositor is None:
+        return
+    if paused:
+        compositor.paused = True
+    else:
+        compositor.resume()
+
+def _warm_serial():
+    """Connect to the wall in the background so the first request finds it ready"""
+    start = time.perf_counter()
+    STARTUP["subsystems"]["serial"] = {"state": "connecting"}
+    ok = False
+    try:
+        ok = sm.ensure_open()
+    except Exception as e:
+        print(f"Serial warm-up failed: {e}")
+    finally:
+        STARTUP["subsystems"]["serial"] = {
+            "state": "ready" if ok else "unavailable",
+            "ms": _elapsed_ms(start),
+            "port": sm.port,
+        }
+
+def _startup_report() -> dict:
+    """STARTUP with the serial state read from the port now, not as warm-up left it"""
+    serial_state = dict(STARTUP["subsystems"]["serial"])
+    if sm.is_open():
+        serial_state["state"] = "ready"
+    elif serial_state["state"] == "ready":
+        serial_state["state"] = "unavailable"  # Disconnected or a write failed since
+    if serial_state["state"] != "idle":
+        serial_state["port"] = sm.port  # /device/connect may have switched ports
+    return {**STARTUP, "subsystems": {**STARTUP["subsystems"], "serial": serial_state}}
+
+
 # --------------- FastAPI --------------------
 app = FastAPI()
 app.add_middleware(
@@ -262,12 +407,31 @@ class ROI(BaseModel):
     w: float  # normalized width
     h: float  # normalized height
 
+class CameraProfile(BaseModel):
+    exposure: Optional[float] = None  # Backend units; disables auto exposure
+    gain: Optional[float] = None
+    wb_temperature: Optional[float] = None  # Kelvin; disables auto white balance
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    fourcc: Optional[str] = None  # Pixel format, e.g. "MJPG"
+    buffer_size: Optional[int] = 1  # Keep only the newest frame queued
+    hw_roi: bool = False  # Crop to the ROI on the sensor where the backend supports it
+
+DEFAULT_CAMERA_PROFILE = CameraProfile(**{k: v for k, v in CAMERA_PROFILE_ENV.items() if v is not None})
+
+class CameraView(BaseModel):
+    index: int  # OpenCV camera index
+    roi: ROI
+
 class StartMapRequest(BaseModel):
     roi: ROI
     brightness: float  # 0..1
     ledPower: bool
     num_leds: Optional[int] = None
     resume_from_led: Optional[int] = None  # Resume mapping from this LED index
+    cameras: Optional[List[CameraView]] = None  # Several views for large walls; first is the reference
+    camera_profile: Optional[CameraProfile] = None  # Overrides the CAM_* environment defaults
 
 class MapResult(BaseModel):
     coords: List[Tuple[float, float]]  # normalized to full frame (0..1, 0..1)
@@ -288,15 +452,22 @@ class LEDPixelReq(BaseModel):
     r: int  # 0-255
     g: int  # 0-255 
     b: int  # 0-255
+    layer: str = "drawing"  # Compositor layer to draw into
 
 class LEDBatchReq(BaseModel):
     pixels: list  # List of [index, r, g, b] arrays
+    layer: str = "drawing"  # Compositor layer to draw into
+
+class LayerConfigReq(BaseModel):
+    opacity: Optional[float] = None  # 0..1
+    blend: Optional[str] = None  # normal, add, multiply, screen, lighten
+    visible: Optional[bool] = None
 
 # --------------- Device helpers -------------
 def _ensure_connected() -> None:
-    if not sm.is_open():
-        if not sm.connect():
-            raise HTTPException(status_code=500, detail="ESP32/Arduino serial not connected")
+    # Waits for the startup connection rather than opening the port twice
+    if not sm.ensure_open():
+        raise HTTPException(status_code=500, detail="ESP32/Arduino serial not connected")
 
 def send_led_command(i: int, brightness: float):
     """Turn on a single LED with specified brightness"""
@@ -307,8 +478,9 @@ def send_led_command(i: int, brightness: float):
 
 def all_off():
     """Turn off all LEDs"""
-    if sm.is_open() or sm.connect():
+    if sm.ensure_open():
         sm.clear_all()
+        _set_wall_color(0, 0, 0)
 
 # --------------- Device routes --------------
 @app.post("/device/connect")
@@ -337,9 +509,15 @@ def device_power(req: PowerReq):
         # Turn all LEDs to white (equal RGB values)
         # Using lower values per channel to keep total power reasonable
         sm.set_all(100, 100, 100)  # White at moderate brightness
+        if compositor is not None:
+            # Keep the white as the background layer so later drawing lands on top of it
+            compositor.fill("background", 100, 100, 100)
+        _set_wall_color(100, 100, 100)
         print(f"✅ ALL {NUM_LEDS} LEDS ON: White at brightness 100")
     else:
         print(f"🔌 TURNING OFF ALL {NUM_LEDS} LEDS")
+        if compositor is not None:
+            compositor.clear_all_layers()
         all_off()
         print(f"✅ ALL {NUM_LEDS} LEDS OFF")
     return {"ok": True}
@@ -352,45 +530,60 @@ def device_set(req: ManualSetReq):
 
 @app.post("/draw/led")
 def draw_led(req: LEDPixelReq):
-    """Set a single LED with RGB color for drawing - optimized for speed"""
+    """Set a single LED with RGB color on a compositor layer"""
     try:
         _ensure_connected()
-        # Use simple pixel method
-        success = sm.set_pixel_fast(req.index, req.r, req.g, req.b)
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to set LED color")
+        _get_compositor().set_pixels(req.layer, [[req.index, req.r, req.g, req.b]])
         return {"ok": True}
     except HTTPException:
         raise
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e).strip("'"))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"LED control error: {str(e)}")
 
 @app.post("/draw/led/batch")
 def draw_led_batch(req: LEDBatchReq):
-    """Set multiple LEDs in a batch - most efficient for drawing"""
+    """Set multiple LEDs on a compositor layer - sent to the wall on the next frame"""
     try:
         _ensure_connected()
-        print(f"🚀 BATCH LED REQUEST: {len(req.pixels)} pixels")
-        print(f"🔍 First 3 pixels: {req.pixels[:3] if req.pixels else 'none'}")
-        
-        # Debug: Log color values being sent 
-        for pixel in req.pixels[:3]:  # Log first 3 pixels for debugging
-            index, r, g, b = pixel
-            print(f"🎨 DEBUG: LED {index} -> R:{r} G:{g} B:{b}")
-        
-        # Use simple batch method with PIXEL commands
-        success = sm.set_pixels_batch(req.pixels)
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to set LED colors")
-        
-        print(f"✅ BATCH LED SUCCESS: Updated {len(req.pixels)} LEDs")
+        print(f"🚀 BATCH LED REQUEST: {len(req.pixels)} pixels on layer '{req.layer}'")
+        _get_compositor().set_pixels(req.layer, req.pixels)
         return {"ok": True}
     except HTTPException:
         raise
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e).strip("'"))
     except Exception as e:
         print(f"❌ BATCH LED ERROR: {str(e)}")
         raise HTTPException(status_code=500, detail=f"LED batch control error: {str(e)}")
 
+@app.get("/layers")
+def list_layers():
+    """List compositor layers from bottom to top"""
+    from compositing import BLEND_MODES
+    return {"layers": _get_compositor().layer_info(), "blend_modes": list(BLEND_MODES), "fps": COMPOSITOR_FPS}
+
+@app.post("/layers/{name}")
+def configure_layer(name: str, req: LayerConfigReq):
+    """Change a layer's opacity, blend mode or visibility"""
+    try:
+        _get_compositor().configure(name, opacity=req.opacity, blend=req.blend, visible=req.visible)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e).strip("'"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True}
+
+@app.post("/layers/{name}/clear")
+def clear_layer(name: str):
+    """Make a layer fully transparent"""
+    try:
+        _get_compositor().clear_layer(name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e).strip("'"))
+    return {"ok": True}
+
 @app.get("/status")
 def status():
     """Get current mapping status"""
@@ -398,69 +591,21 @@ def status():
         return dict(STATUS)
 
 # --------------- Mapping helpers ------------
-def _centroid_of_mask(mask: np.ndarray) -> Tuple[float, float]:
-    """Calculate centroid of a binary mask"""
-    M = cv2.moments(mask, binaryImage=True)
-    if M["m00"] == 0:
-        ys, xs = np.where(mask > 0)
-        if len(xs) == 0:
-            return (0.0, 0.0)
-        return (float(np.mean(xs)), float(np.mean(ys)))
-    cx = float(M["m10"] / M["m00"])
-    cy = float(M["m01"] / M["m00"])
-    return (cx, cy)
-
-def _find_single_spot(gray_roi: np.ndarray, tolerance: int) -> Tuple[bool, Tuple[float, float]]:
-    """Find a single bright spot in the ROI"""
-    _, maxVal, _, _ = cv2.minMaxLoc(gray_roi)
-    thresh_val = max(0, maxVal - tolerance)
-    _, mask = cv2.threshold(gray_roi, thresh_val, 255, cv2.THRESH_BINARY)
-    mask = mask.astype(np.uint8)
-
-    num_labels, _ = cv2.connectedComponents(mask)
-    num_blobs = num_labels - 1  # background is 0
-    if num_blobs <= 0:
-        return False, (0.0, 0.0)
-    if num_blobs == 1:
-        cx, cy = _centroid_of_mask(mask)
-        return True, (cx, cy)
-    return False, (0.0, 0.0)
-
 def _normalize_point(px: float, py: float, full_w: int, full_h: int) -> Tuple[float, float]:
     """Normalize pixel coordinates to 0..1 range"""
     return px / float(full_w), py / float(full_h)
 
-# --------------- Mapping worker -------------
-def _mapping_worker(req: StartMapRequest):
-    """Worker thread for LED mapping process"""
-    print("\n🧵 MAPPING WORKER THREAD STARTED")
-    print(f"🔍 DEBUG: Worker received request = {req}")
-    print("🔧 STEP 1: Checking device connection...")
-    
-    try:
-        print("Checking device connection...")
-        _ensure_connected()
-        print("Device connected successfully")
-    except HTTPException as e:
-        print(f"Device connection failed: {e}")
-        status_update(running=False, done=True)
-        return
-
-    print(f"Attempting to open camera with index {CAM_INDEX}...")
-    
-    # Wait longer for frontend to release camera
-    print("Waiting 3 seconds for frontend to release camera...")
-    time.sleep(3)
-    
+def _open_camera(index: int):
+    """Open a camera, retrying while another application may still hold it"""
     # Try multiple times to open camera
     cap = None
     for attempt in range(5):
         try:
-            print(f"Camera attempt {attempt + 1}/5")
-            cap = cv2.VideoCapture(CAM_INDEX)
+            print(f"Camera {index} attempt {attempt + 1}/5")
+            cap = cv2.VideoCapture(index)
             if not cap.isOpened():
-                if cap:
-                    cap.release()
+                cap.release()
+                cap = None
                 print(f"Attempt {attempt + 1}: Failed to open camera - may be in use")
                 time.sleep(1)  # Wait 1 second between attempts
                 continue
@@ -486,141 +631,212 @@ def _mapping_worker(req: StartMapRequest):
                 cap = None
             time.sleep(1)  # Wait 1 second between attempts
     
+    return cap
+
+def _apply_profile(cap, req: StartMapRequest, roi: ROI):
+    """Apply the mapping camera profile to an open camera; returns (saved, report)"""
+    profile = DEFAULT_CAMERA_PROFILE
+    if req.camera_profile is not None:
+        profile = profile.copy(update=req.camera_profile.dict(exclude_unset=True))
+    saved, report = vision.apply_camera_profile(cap, profile.dict(), roi=(roi.x, roi.y, roi.w, roi.h))
+    print(f"📷 Camera profile: {report}")
+    return saved, report
+
+# --------------- Mapping worker -------------
+def _mapping_worker(req: StartMapRequest):
+    """Worker thread for LED mapping process"""
+    print("\n🧵 MAPPING WORKER THREAD STARTED")
+    print(f"🔍 DEBUG: Worker received request = {req}")
+    print("🔧 STEP 1: Checking device connection...")
+    
+    try:
+        print("Checking device connection...")
+        _ensure_connected()
+        print("Device connected successfully")
+    except HTTPException as e:
+        print(f"Device connection failed: {e}")
+        status_update(running=False, done=True)
+        return
+
+    if not _vision_ready():
+        return
+    # Mapping drives single LEDs directly; hold compositor output until done
+    _pause_compositor(True)
+
+    cam_index = CAM_INDEX
+    if req.cameras:
+        cam_index = req.cameras[0].index
+        req.roi = req.cameras[0].roi
+    print(f"Attempting to open camera with index {cam_index}...")
+    
+    # Wait longer for frontend to release camera
+    print("Waiting 3 seconds for frontend to release camera...")
+    time.sleep(3)
+    
+    cap = _open_camera(cam_index)
+
     if cap is None:
         print("Failed to access camera after 5 attempts")
         status_update(running=False, done=True, status="error", message="Failed to access camera after 5 attempts. Please ensure the camera is not in use by another application.")
+        _pause_compositor(False)
         return
 
     coords: List[Tuple[float, float]] = []
+    saved_profile: list = []
+    led_index = req.resume_from_led if req.resume_from_led is not None else 0
+    error = None
+    try:
+        # Fixed exposure/gain and the smallest useful frame, restored when mapping ends
+        saved_profile, profile_report = _apply_profile(cap, req, req.roi)
 
-    # Get initial frame for dimensions
-    ok, frame = cap.read()
-    if not ok:
-        cap.release()
-        status_update(running=False, done=True, status="error", message="Failed to read from camera. Please check camera connection.")
-        return
-    H, W = frame.shape[:2]
-    status_update(w=W, h=H, roi=req.roi.dict())
+        # Get initial frame for dimensions
+        ok, frame = cap.read()
+        if not ok:
+            status_update(running=False, done=True, status="error", message="Failed to read from camera. Please check camera connection.")
+            return  # Camera settings restored below
+        H, W = frame.shape[:2]
+        ox = oy = 0  # Sensor offset of the delivered frame when the camera crops to the ROI
+        crop = profile_report.get("crop")
+        if crop:
+            W, H, ox, oy = crop["sensor_w"], crop["sensor_h"], crop["x"], crop["y"]
+        status_update(w=W, h=H, roi=req.roi.dict(), camera_profile=[profile_report], camera_index=cam_index)
 
-    # ROI in pixel coords
-    rx = int(req.roi.x * W)
-    ry = int(req.roi.y * H)
-    rw = max(1, int(req.roi.w * W))
-    rh = max(1, int(req.roi.h * H))
+        # ROI in pixel coords within the delivered frame
+        rx = int(req.roi.x * W) - ox
+        ry = int(req.roi.y * H) - oy
+        rw = max(1, int(req.roi.w * W))
+        rh = max(1, int(req.roi.h * H))
 
-    # Ensure all LEDs are off before starting
-    all_off()
-    time.sleep(0.5)  # Let the LEDs settle
+        # Ensure all LEDs are off before starting
+        all_off()
+        time.sleep(0.5)  # Let the LEDs settle
 
-    base_brightness = float(np.clip(req.brightness, MIN_BRIGHTNESS, MAX_BRIGHTNESS))
+        base_brightness = float(np.clip(req.brightness, MIN_BRIGHTNESS, MAX_BRIGHTNESS))
     
-    # Convert to Arduino brightness scale (0-255)
-    arduino_brightness = int(base_brightness * 255)
-    sm.set_brightness(arduino_brightness)
+        # Convert to Arduino brightness scale (0-255)
+        arduino_brightness = int(base_brightness * 255)
+        sm.set_brightness(arduino_brightness)
     
-    print(f"Starting adaptive LED mapping with brightness {base_brightness}")
-    print(f"Will stop after {MAX_CONSECUTIVE_FAILURES} consecutive failures")
+        print(f"Starting adaptive LED mapping with brightness {base_brightness}")
+        print(f"Will stop after {MAX_CONSECUTIVE_FAILURES} consecutive failures")
     
-    consecutive_failures = 0
-    led_index = req.resume_from_led if req.resume_from_led is not None else 0
+        consecutive_failures = 0
     
-    if req.resume_from_led is not None:
-        print(f"🔄 RESUME MODE: Starting from LED {req.resume_from_led}")
-    else:
-        print(f"🆕 NEW MAPPING: Starting from LED 0")
+        if req.resume_from_led is not None:
+            print(f"🔄 RESUME MODE: Starting from LED {req.resume_from_led}")
+        else:
+            print(f"🆕 NEW MAPPING: Starting from LED 0")
     
-    while consecutive_failures < MAX_CONSECUTIVE_FAILURES:
-        print(f"\n💡 LED {led_index}: Starting mapping process")
-        status_update(current_led=led_index, consecutive_failures=consecutive_failures)
-        current_brightness = base_brightness
-        attempts = 0
-        spot_found = False
-
-        # Use timer-based approach: LED on for minimal duration since detection is fast
-        led_on_duration = 0.2  # 200ms total - detection happens in ~105ms
+        while consecutive_failures < MAX_CONSECUTIVE_FAILURES:
+            print(f"\n💡 LED {led_index}: Starting mapping process")
+            status_update(current_led=led_index, consecutive_failures=consecutive_failures)
+            current_brightness = base_brightness
+            attempts = 0
+            spot_found = False
+
+            # Use timer-based approach: LED on for minimal duration since detection is fast
+            led_on_duration = 0.2  # 200ms total - detection happens in ~105ms
         
-        print(f"🔆 LED {led_index}: Turning ON with brightness {current_brightness} for {led_on_duration*1000}ms")
-        send_led_command(led_index, current_brightness)
+            print(f"🔆 LED {led_index}: Turning ON with brightness {current_brightness} for {led_on_duration*1000}ms")
+            send_led_command(led_index, current_brightness)
         
-        # Start timer AFTER the LED command is sent
-        start_time = time.time()
+            # Start timer AFTER the LED command is sent
+            start_time = time.time()
         
-        # Minimal settle time
-        time.sleep(0.05)  # 50ms settle
-        print(f"⏱️ LED {led_index}: Starting detection loop after {(time.time() - start_time)*1000:.0f}ms")
+            # Minimal settle time
+            time.sleep(0.05)  # 50ms settle
+            print(f"⏱️ LED {led_index}: Starting detection loop after {(time.time() - start_time)*1000:.0f}ms")
         
-        while time.time() - start_time < led_on_duration and not spot_found:
-            elapsed = time.time() - start_time
-            print(f"🔍 LED {led_index}: Loop iteration at {elapsed*1000:.0f}ms")
-            ok, frame = cap.read()
-            if not ok:
-                print(f"Failed to read frame for LED {led_index}")
-                break
+            while time.time() - start_time < led_on_duration and not spot_found:
+                elapsed = time.time() - start_time
+                print(f"🔍 LED {led_index}: Loop iteration at {elapsed*1000:.0f}ms")
+                ok, frame = cap.read()
+                if not ok:
+                    print(f"Failed to read frame for LED {led_index}")
+                    break
             
-            # Extract ROI
-            roi_img = frame[ry:ry+rh, rx:rx+rw]
-            gray = cv2.cvtColor(roi_img, cv2.COLOR_BGR2GRAY)
-            gray = cv2.GaussianBlur(gray, (5, 5), 0)
-
-            # Try to find single spot
-            ok1, (cx_roi, cy_roi) = _find_single_spot(gray, TOLERANCE)
-            if ok1:
-                # Convert ROI coordinates to full frame coordinates
-                cx_full = rx + cx_roi
-                cy_full = ry + cy_roi
-                nx, ny = _normalize_point(cx_full, cy_full, W, H)
+                # Extract ROI
+                roi_img = frame[ry:ry+rh, rx:rx+rw]
+                gray = roi_img if roi_img.ndim == 2 else cv2.cvtColor(roi_img, cv2.COLOR_BGR2GRAY)
+                gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+                # Try to find single spot
+                ok1, (cx_roi, cy_roi) = vision.find_single_spot(gray, TOLERANCE)
+                if ok1:
+                    # Convert ROI coordinates to full frame coordinates
+                    cx_full = ox + rx + cx_roi
+                    cy_full = oy + ry + cy_roi
+                    nx, ny = _normalize_point(cx_full, cy_full, W, H)
                 
-                # Just record the position, even if it overlaps with previous LEDs
-                coords.append((nx, ny))
-                status_append_coord(nx, ny)
-                spot_found = True
-                consecutive_failures = 0  # Reset failure counter on success
-                print(f"✅ LED {led_index}: Found at ({nx:.3f}, {ny:.3f}) after {elapsed*1000:.0f}ms")
-                # Turn off LED immediately when found
-                send_led_command(led_index, 0.0)
-                break  # Exit detection loop immediately
-            else:
-                print(f"🔍 LED {led_index}: Attempt {attempts + 1} at {elapsed*1000:.0f}ms - not detected")
-                # Try reducing brightness if we still have time and not too many attempts
-                if elapsed < led_on_duration * 0.7 and attempts < 3:  # Only reduce brightness in first 70% of time, max 3 attempts
-                    current_brightness = max(MIN_BRIGHTNESS, current_brightness * 0.8)
+                    # Just record the position, even if it overlaps with previous LEDs
+                    coords.append((nx, ny))
+                    status_append_coord(nx, ny)
+                    spot_found = True
+                    consecutive_failures = 0  # Reset failure counter on success
+                    print(f"✅ LED {led_index}: Found at ({nx:.3f}, {ny:.3f}) after {elapsed*1000:.0f}ms")
+                    # Turn off LED immediately when found
+                    send_led_command(led_index, 0.0)
+                    break  # Exit detection loop immediately
+                else:
+                    print(f"🔍 LED {led_index}: Attempt {attempts + 1} at {elapsed*1000:.0f}ms - not detected")
+                    # Try reducing brightness if we still have time and not too many attempts
+                    if elapsed < led_on_duration * 0.7 and attempts < 3:  # Only reduce brightness in first 70% of time, max 3 attempts
+                        current_brightness = max(MIN_BRIGHTNESS, current_brightness * 0.8)
                     
-                    # If brightness hits minimum, stop trying immediately
-                    if current_brightness <= MIN_BRIGHTNESS:
-                        print(f"LED {led_index}: Brightness at minimum ({MIN_BRIGHTNESS}), giving up")
-                        break
+                        # If brightness hits minimum, stop trying immediately
+                        if current_brightness <= MIN_BRIGHTNESS:
+                            print(f"LED {led_index}: Brightness at minimum ({MIN_BRIGHTNESS}), giving up")
+                            break
                         
-                    print(f"🔆 LED {led_index}: Reducing brightness to {current_brightness:.2f}")
-                    send_led_command(led_index, current_brightness)
-                    time.sleep(0.03)  # 30ms settle after brightness change
+                        print(f"🔆 LED {led_index}: Reducing brightness to {current_brightness:.2f}")
+                        send_led_command(led_index, current_brightness)
+                        time.sleep(0.03)  # 30ms settle after brightness change
                 
-                attempts += 1
+                    attempts += 1
 
-        # Turn off current LED (if not already turned off when found)
-        total_time = time.time() - start_time
-        if not spot_found:
-            send_led_command(led_index, 0.0)
-        # No delay between LEDs - immediate transition
-
-        if not spot_found:
-            print(f"❌ LED {led_index}: Not found after {attempts} attempts in {total_time*1000:.0f}ms")
-            coords.append((0.0, 0.0))
-            status_append_coord(0.0, 0.0)
-            consecutive_failures += 1
-            print(f"Consecutive failures: {consecutive_failures}/{MAX_CONSECUTIVE_FAILURES}")
+            # Turn off current LED (if not already turned off when found)
+            total_time = time.time() - start_time
+            if not spot_found:
+                send_led_command(led_index, 0.0)
+            # No delay between LEDs - immediate transition
+
+            if not spot_found:
+                print(f"❌ LED {led_index}: Not found after {attempts} attempts in {total_time*1000:.0f}ms")
+                coords.append((0.0, 0.0))
+                status_append_coord(0.0, 0.0)
+                consecutive_failures += 1
+                print(f"Consecutive failures: {consecutive_failures}/{MAX_CONSECUTIVE_FAILURES}")
         
-        led_index += 1
+            led_index += 1
         
-        # Update status with current progress
-        status_update(total_leds=led_index, consecutive_failures=consecutive_failures)
+            # Update status with current progress
+            status_update(total_leds=led_index, consecutive_failures=consecutive_failures)
     
-    print(f"\n🛑 Mapping stopped: {consecutive_failures} consecutive failures detected")
-    print(f"📊 Total LEDs processed: {led_index}")
-    print(f"✅ LEDs found: {len([c for c in coords if c != (0.0, 0.0)])}")
-    print(f"❌ LEDs not found: {len([c for c in coords if c == (0.0, 0.0)])}")
+        print(f"\n🛑 Mapping stopped: {consecutive_failures} consecutive failures detected")
+        print(f"📊 Total LEDs processed: {led_index}")
+        print(f"✅ LEDs found: {len([c for c in coords if c != (0.0, 0.0)])}")
+        print(f"❌ LEDs not found: {len([c for c in coords if c == (0.0, 0.0)])}")
+    except Exception as e:
+        # e.g. send_led_command raising when the serial link drops
+        error = getattr(e, "detail", None) or str(e)
+        print(f"❌ Mapping failed at LED {led_index}: {error}")
+    finally:
+        # Never leave the camera in manual mode or held, or the wall paused
+        try:
+            vision.restore_camera_profile(cap, saved_profile)
+        except Exception as e:
+            print(f"Failed to restore camera settings: {e}")
+        cap.release()
+        try:
+            all_off()
+        except Exception as e:
+            print(f"Failed to turn LEDs off: {e}")
+        _pause_compositor(False)
 
-    cap.release()
-    all_off()
+    if error is not None:
+        status_update(running=False, done=True, current_led=-1, status="error",
+                      message=f"Mapping failed at LED {led_index}: {error}")
+        return
 
     # Save mapping results
     total_found = len([c for c in coords if c != (0.0, 0.0)])
@@ -640,6 +856,225 @@ def _mapping_worker(req: StartMapRequest):
     print(f"Adaptive mapping complete! Saved {total_found}/{led_index} LED positions to mapping.json")
     status_update(done=True, running=False, current_led=-1, total_leds=led_index)
 
+# --------------- Multi-view mapping ---------
+class _View:
+    """One camera of a multi-view mapping run: capture thread feeding a shared frame buffer"""
+
+    def __init__(self, index: int, cap, roi: ROI, frame: "np.ndarray", saved_profile: list, profile_report: dict):
+        self.index = index
+        self.cap = cap
+        self.roi = roi
+        self.saved_profile = saved_profile
+        self.profile_report = profile_report
+        self.H, self.W = frame.shape[:2]
+        self.ox = self.oy = 0  # Sensor offset of the delivered frame when the camera crops to the ROI
+        crop = profile_report.get("crop")
+        if crop:
+            self.W, self.H, self.ox, self.oy = crop["sensor_w"], crop["sensor_h"], crop["x"], crop["y"]
+        fh, fw = frame.shape[:2]
+        self.rx = int(roi.x * self.W) - self.ox
+        self.ry = int(roi.y * self.H) - self.oy
+        self.rw = max(1, min(int(roi.w * self.W), fw - self.rx))
+        self.rh = max(1, min(int(roi.h * self.H), fh - self.ry))
+        self.buffer = vision.FrameBuffer((self.rh, self.rw))
+        self.stop = threading.Event()
+        self.thread = Thread(target=self._capture, daemon=True)
+
+    def _capture(self):
+        while not self.stop.is_set():
+            ok, frame = self.cap.read()
+            if not ok:
+                print(f"Camera {self.index}: failed to read frame")
+                time.sleep(0.01)
+                continue
+            roi_img = frame[self.ry:self.ry + self.rh, self.rx:self.rx + self.rw]
+            self.buffer.write(roi_img if roi_img.ndim == 2 else cv2.cvtColor(roi_img, cv2.COLOR_BGR2GRAY))
+
+    def close(self):
+        self.stop.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout=1.0)
+        vision.restore_camera_profile(self.cap, self.saved_profile)
+        self.cap.release()
+        self.buffer.close()
+
+def _detect_all_views(pool: ProcessPoolExecutor, views: List[_View], timeout: float) -> dict:
+    """Look for the lit LED in every view at once; returns {view: (px, py)} in full-frame pixels.
+
+    Once one view sees the LED the others get a couple of frames to catch
+    up, then the remaining tasks are cancelled, so an LED outside most
+    views costs about as much as with a single camera.
+    """
+    futures = {
+        pool.submit(vision.detect_spot, view.buffer.name, (view.rh, view.rw), view.buffer.seq,
+                    view.buffer.cancel_gen, timeout, TOLERANCE): v
+        for v, view in enumerate(views)
+    }
+    fps = [view.profile_report.get("measured_fps") or 30.0 for view in views]
+    grace = 2.0 / max(1.0, min(fps))  # Two frames of the slowest camera
+    found = {}
+    pending = set(futures)
+    grace_deadline = None
+    while pending:
+        wait_for = None if grace_deadline is None else max(0.0, grace_deadline - time.time())
+        done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+        if not done:
+            break  # Grace period over
+        for fut in done:
+            spot = fut.result()
+            if spot is not None:
+                view = views[futures[fut]]
+                found[futures[fut]] = (view.ox + view.rx + spot[0], view.oy + view.ry + spot[1])
+                if grace_deadline is None:
+                    grace_deadline = time.time() + grace
+    if pending:
+        for view in views:
+            view.buffer.cancel()
+        wait(pending)  # Tasks notice the cancel within a frame; frees the pool for the next LED
+    return found
+
+def _multi_view_mapping_worker(req: StartMapRequest):
+    """Worker thread for LED mapping with several cameras.
+
+    Each camera is captured on its own thread into a shared-memory frame
+    buffer, and detection for all views runs in parallel in a process pool.
+    Views are aligned to the first camera using the LEDs they both saw, and
+    the saved coordinates are normalized to the bounding box of all found
+    LEDs rather than to any one camera's frame.
+    """
+    print(f"\n🧵 MULTI-VIEW MAPPING WORKER STARTED: cameras {[c.index for c in req.cameras]}")
+    try:
+        _ensure_connected()
+    except HTTPException as e:
+        print(f"Device connection failed: {e}")
+        status_update(running=False, done=True)
+        return
+
+    if not _vision_ready():
+        return
+    _pause_compositor(True)
+    print("Waiting 3 seconds for frontend to release camera...")
+    time.sleep(3)
+
+    views: List[_View] = []
+    for cam in req.cameras:
+        cap = _open_camera(cam.index)
+        saved_profile, profile_report = _apply_profile(cap, req, cam.roi) if cap is not None else ([], {})
+        ok, frame = cap.read() if cap is not None else (False, None)
+        if not ok:
+            if cap is not None:
+                vision.restore_camera_profile(cap, saved_profile)
+                cap.release()
+            for view in views:
+                view.close()
+            status_update(running=False, done=True, status="error", message=f"Failed to access camera {cam.index}. Please ensure it is connected and not in use by another application.")
+            _pause_compositor(False)
+            return
+        views.append(_View(cam.index, cap, cam.roi, frame, saved_profile, profile_report))
+
+    ref = views[0]
+    status_update(w=ref.W, h=ref.H, roi=req.cameras[0].roi.dict(), camera_profile=[view.profile_report for view in views],
+                  cameras=[view.index for view in views])
+    for view in views:
+        view.thread.start()
+
+    pool = ProcessPoolExecutor(max_workers=len(views), mp_context=multiprocessing.get_context("spawn"))
+    observations: List[dict] = []
+    consecutive_failures = 0
+    led_index = 0
+    error = None
+    try:
+        # Start the detection processes before the first LED is timed
+        for fut in [pool.submit(vision.warm_up) for _ in views]:
+            fut.result()
+
+        all_off()
+        time.sleep(0.5)  # Let the LEDs settle
+
+        base_brightness = float(np.clip(req.brightness, MIN_BRIGHTNESS, MAX_BRIGHTNESS))
+        sm.set_brightness(int(base_brightness * 255))
+        led_on_duration = 0.2  # Same window as single-camera mapping
+
+        while consecutive_failures < MAX_CONSECUTIVE_FAILURES:
+            status_update(current_led=led_index, consecutive_failures=consecutive_failures)
+            current_brightness = base_brightness
+            found = {}
+            for attempt in range(3):
+                send_led_command(led_index, current_brightness)
+                time.sleep(0.05)  # 50ms settle
+                found = _detect_all_views(pool, views, led_on_duration - 0.05)
+                if found:
+                    break
+                current_brightness = current_brightness * 0.8
+                if current_brightness <= MIN_BRIGHTNESS:
+                    break
+            send_led_command(led_index, 0.0)
+
+            observations.append(found)
+            if found:
+                # Live preview in the camera's own frame; replaced by merged coords at the end
+                v, (px, py) = next(iter(found.items()))
+                status_append_coord(*_normalize_point(px, py, views[v].W, views[v].H))
+                consecutive_failures = 0
+                print(f"✅ LED {led_index}: seen by cameras {[views[v].index for v in found]}")
+            else:
+                status_append_coord(0.0, 0.0)
+                consecutive_failures += 1
+                print(f"❌ LED {led_index}: not found ({consecutive_failures}/{MAX_CONSECUTIVE_FAILURES})")
+
+            led_index += 1
+            status_update(total_leds=led_index, consecutive_failures=consecutive_failures)
+    except Exception as e:
+        # e.g. BrokenProcessPool when a detection process dies
+        error = e
+        print(f"❌ Multi-view mapping failed at LED {led_index}: {e}")
+    finally:
+        try:
+            for fut in [pool.submit(vision.release_buffer, view.buffer.name) for view in views]:
+                fut.result()
+        except Exception as e:
+            print(f"Could not detach frame buffers from detection processes: {e}")
+        pool.shutdown(wait=False, cancel_futures=True)
+        for view in views:
+            try:
+                view.close()
+            except Exception as e:
+                print(f"Camera {view.index}: cleanup failed: {e}")
+        try:
+            all_off()
+        except Exception as e:
+            print(f"Failed to turn LEDs off: {e}")
+        _pause_compositor(False)
+
+    if error is not None:
+        status_update(running=False, done=True, current_led=-1, status="error",
+                      message=f"Multi-view mapping failed at LED {led_index}: {error}")
+        return
+
+    coords, W, H, aligned = vision.merge_views(observations, len(views))
+    total_found = len([c for c in coords if c != (0.0, 0.0)])
+    out = {
+        "coords": coords,
+        "coordinate_space": "bbox",  # Normalized to the bounding box of found LEDs; w/h in camera-0 pixels
+        "roi": None,  # Per-camera ROIs are listed under "cameras"
+        "w": W,
+        "h": H,
+        "total_leds": led_index,
+        "leds_found": total_found,
+        "adaptive_mode": True,
+        "consecutive_failures": consecutive_failures,
+        "cameras": [
+            {"index": view.index, "roi": view.roi.dict(), "w": view.W, "h": view.H, "aligned": v in aligned,
+             "profile": view.profile_report}
+            for v, view in enumerate(views)
+        ],
+    }
+    with open("mapping.json", "w") as f:
+        json.dump(out, f, indent=2)
+
+    print(f"Multi-view mapping complete! Saved {total_found}/{led_index} LED positions from {len(views)} cameras to mapping.json")
+    status_update(done=True, running=False, current_led=-1, total_leds=led_index, coords=coords, w=W, h=H, roi=None)
+
 # --------------- Routes ---------------------
 @app.options("/start_mapping")
 def start_mapping_options():
@@ -660,6 +1095,11 @@ def start_mapping(req: StartMapRequest):
     print(f"🔍 DEBUG: LED Power = {req.ledPower}")
     print(f"🔍 DEBUG: Num LEDs = {req.num_leds}")
     
+    multi_view = bool(req.cameras) and len(req.cameras) > 1
+    if multi_view and req.resume_from_led is not None:
+        # Merging needs every view's raw observations, which are not kept between runs
+        raise HTTPException(status_code=400, detail="Resuming is not supported for multi-camera mapping. Start a new mapping instead.")
+
     print("🔒 ACQUIRING STATUS LOCK...")
     with STATUS_LOCK:
         print("✅ STATUS LOCK ACQUIRED")
@@ -673,7 +1113,8 @@ def start_mapping(req: StartMapRequest):
     
     print("🧵 STARTING BACKGROUND THREAD: Mapping worker")
     # Start mapping in background thread
-    th = Thread(target=_mapping_worker, args=(req,), daemon=True)
+    worker = _multi_view_mapping_worker if multi_view else _mapping_worker
+    th = Thread(target=worker, args=(req,), daemon=True)
     th.start()
     print("✅ MAPPING INITIATED: Returning success response")
     return {"ok": True, "message": "Mapping started"}
@@ -686,25 +1127,32 @@ def resume_mapping_from_led(resume_from: int, brightness: float = 0.5):
     with STATUS_LOCK:
         if STATUS.get("running"):
             raise HTTPException(status_code=409, detail="Mapping already in progress")
+
+        if STATUS.get("cameras"):
+            raise HTTPException(status_code=400, detail="The last mapping used several cameras and cannot be resumed. Start a new mapping instead.")
         
         # Get the last successful ROI from status if available
         last_roi = STATUS.get("roi")
+        last_camera = STATUS.get("camera_index")
         if not last_roi:
             raise HTTPException(status_code=400, detail="No previous mapping ROI found. Start a new mapping instead.")
         
         status_reset()
     
     # Create a request object for resuming
+    roi = ROI(
+        x=last_roi["x"],
+        y=last_roi["y"], 
+        w=last_roi["w"],
+        h=last_roi["h"]
+    )
     resume_req = StartMapRequest(
-        roi=ROI(
-            x=last_roi["x"],
-            y=last_roi["y"], 
-            w=last_roi["w"],
-            h=last_roi["h"]
-        ),
+        roi=roi,
         brightness=brightness,
         ledPower=True,
-        resume_from_led=resume_from
+        resume_from_led=resume_from,
+        # Same camera as the interrupted run, not necessarily CAM_INDEX
+        cameras=[CameraView(index=last_camera, roi=roi)] if last_camera is not None else None,
     )
     
     # Start the mapping worker thread
@@ -733,15 +1181,26 @@ def load_mapping():
         print(f"❌ LOAD_MAPPING ERROR: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to load mapping: {str(e)}")
 
+@app.on_event("startup")
+def startup():
+    """Connect serial in the background; camera, vision and compositor load on first use"""
+    Thread(target=_warm_serial, daemon=True).start()
+    STARTUP["app_ready_ms"] = _elapsed_ms(_T0)
+    print(f"⏱️ STARTUP: module import {STARTUP['import_ms']} ms, app ready {STARTUP['app_ready_ms']} ms, serial connecting in background")
+
 @app.get("/")
 def root():
     """Health check endpoint"""
-    return {"status": "LED Mapper Backend Running", "serial_connected": sm.is_open()}
+    return {"status": "LED Mapper Backend Running", "serial_connected": sm.is_open(), "startup": _startup_report()}
 
 # Cleanup on shutdown
 import atexit
 def cleanup():
+    if compositor is not None:
+        compositor.stop()
     all_off()
     sm.close()
 
-atexit.register(cleanup)
\ No newline at end of file
+atexit.register(cleanup)
+
+STARTUP["import_ms"] = _elapsed_ms(_T0)
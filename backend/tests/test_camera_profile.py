@@ -0,0 +1,119 @@
+import cv2
+import numpy as np
+import pytest
+
+from vision import apply_camera_profile, restore_camera_profile
+
+def fourcc(code):
+    return float(cv2.VideoWriter_fourcc(*code))
+
+class FakeCap:
+    """Stub capture whose properties only change when the backend accepts them.
+
+    accept maps a property to a function turning the requested value into what
+    the driver stores; properties missing from it ignore every set().
+    """
+
+    def __init__(self, accept, **props):
+        self.props = {
+            cv2.CAP_PROP_FOURCC: fourcc("YUY2"),
+            cv2.CAP_PROP_FRAME_WIDTH: 640.0,
+            cv2.CAP_PROP_FRAME_HEIGHT: 480.0,
+            cv2.CAP_PROP_FPS: 30.0,
+            cv2.CAP_PROP_BUFFERSIZE: 4.0,
+            cv2.CAP_PROP_AUTO_EXPOSURE: 3.0,
+            cv2.CAP_PROP_EXPOSURE: -4.0,
+            cv2.CAP_PROP_GAIN: 10.0,
+            cv2.CAP_PROP_XI_WIDTH: 0.0,
+            cv2.CAP_PROP_XI_HEIGHT: 0.0,
+            cv2.CAP_PROP_XI_OFFSET_X: 0.0,
+            cv2.CAP_PROP_XI_OFFSET_Y: 0.0,
+        }
+        self.props.update(props)
+        self.accept = accept
+
+    def set(self, prop, value):
+        if prop in self.accept:
+            self.props[prop] = self.accept[prop](value)
+        return prop in self.accept
+
+    def get(self, prop):
+        return self.props.get(prop, 0.0)
+
+    def read(self):
+        w = int(self.props[cv2.CAP_PROP_FRAME_WIDTH])
+        h = int(self.props[cv2.CAP_PROP_FRAME_HEIGHT])
+        return True, np.zeros((h, w, 3), dtype=np.uint8)
+
+def same(value):
+    return value
+
+def test_accepted_settings_read_back_ok():
+    cap = FakeCap({
+        cv2.CAP_PROP_FOURCC: same,
+        cv2.CAP_PROP_FRAME_WIDTH: same,
+        cv2.CAP_PROP_FRAME_HEIGHT: same,
+        cv2.CAP_PROP_AUTO_EXPOSURE: same,
+        cv2.CAP_PROP_EXPOSURE: same,
+        cv2.CAP_PROP_GAIN: lambda v: v + 0.4,  # Driver rounding
+    })
+    saved, report = apply_camera_profile(cap, {"fourcc": "MJPG", "width": 320, "height": 240, "exposure": -7, "gain": 0})
+    assert report["fourcc"] == {"requested": "MJPG", "actual": "MJPG", "ok": True}
+    assert report["width"]["ok"] and report["height"]["ok"]
+    assert report["frame_size"] == [320, 240]
+    assert report["auto_exposure"]["ok"] and report["auto_exposure"]["actual"] == 1.0
+    assert report["exposure"]["ok"] and report["gain"]["ok"]
+    assert report["measured_fps"] is not None
+    assert "crop" not in report
+
+def test_ignored_settings_are_reported():
+    # Only the 0.25 DirectShow value is accepted for manual exposure
+    cap = FakeCap({
+        cv2.CAP_PROP_AUTO_EXPOSURE: lambda v: v if v == 0.25 else 3.0,
+        cv2.CAP_PROP_FRAME_WIDTH: lambda v: 640.0,
+    })
+    _, report = apply_camera_profile(cap, {"exposure": -7, "width": 320})
+    assert report["auto_exposure"]["ok"] and report["auto_exposure"]["actual"] == 0.25
+    assert not report["exposure"]["ok"]
+    assert report["width"] == {"requested": 320.0, "actual": 640.0, "ok": False}
+
+@pytest.mark.parametrize("requested, delivered", [("NV12", "YUY2"), ("H264", "X264")])
+def test_fourcc_must_match_exactly(requested, delivered):
+    cap = FakeCap({cv2.CAP_PROP_FOURCC: lambda v: fourcc(delivered)})
+    _, report = apply_camera_profile(cap, {"fourcc": requested})
+    assert report["fourcc"] == {"requested": requested, "actual": delivered, "ok": False}
+
+def test_restore_puts_original_values_back():
+    cap = FakeCap({prop: same for prop in (
+        cv2.CAP_PROP_FOURCC, cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT,
+        cv2.CAP_PROP_AUTO_EXPOSURE, cv2.CAP_PROP_EXPOSURE, cv2.CAP_PROP_BUFFERSIZE)})
+    before = dict(cap.props)
+    saved, _ = apply_camera_profile(cap, {"fourcc": "MJPG", "width": 320, "height": 240, "exposure": -7, "buffer_size": 1})
+    assert cap.props != before
+    restore_camera_profile(cap, saved)
+    assert cap.props == before
+
+def test_hw_roi_crops_on_the_sensor():
+    xi = (cv2.CAP_PROP_XI_WIDTH, cv2.CAP_PROP_XI_HEIGHT, cv2.CAP_PROP_XI_OFFSET_X, cv2.CAP_PROP_XI_OFFSET_Y)
+    cap = FakeCap({prop: same for prop in xi})
+    saved, report = apply_camera_profile(cap, {"hw_roi": True}, roi=(0.25, 0.5, 0.5, 0.25))
+    assert report["crop"] == {"x": 160, "y": 240, "w": 320, "h": 120, "sensor_w": 640, "sensor_h": 480}
+    assert [prop for prop, _ in saved] == list(xi)
+    restore_camera_profile(cap, saved)
+    assert all(cap.props[prop] == 0.0 for prop in xi)
+
+def test_partial_hw_roi_is_rolled_back():
+    # Width and height stick, then the x offset is changed to something else
+    cap = FakeCap({
+        cv2.CAP_PROP_XI_WIDTH: same,
+        cv2.CAP_PROP_XI_HEIGHT: same,
+        cv2.CAP_PROP_XI_OFFSET_X: lambda v: v - v % 64,  # Snaps to its alignment
+        cv2.CAP_PROP_GAIN: same,
+    })
+    saved, report = apply_camera_profile(cap, {"gain": 5, "hw_roi": True}, roi=(0.25, 0.5, 0.5, 0.25))
+    assert report["crop"] is None
+    assert saved == [(cv2.CAP_PROP_GAIN, 10.0)]
+    assert cap.props[cv2.CAP_PROP_XI_WIDTH] == 0.0
+    assert cap.props[cv2.CAP_PROP_XI_HEIGHT] == 0.0
+    assert cap.props[cv2.CAP_PROP_XI_OFFSET_X] == 0.0
+    assert cap.props[cv2.CAP_PROP_GAIN] == 5.0
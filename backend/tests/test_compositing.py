@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from compositing import Compositor
+
+class FakeWall:
+    """Stub serial output recording each batch of [index, r, g, b] updates"""
+
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+        self.during_send = None  # Called inside send(), to interleave other writers
+
+    def send(self, updates):
+        if self.during_send:
+            self.during_send()
+        if self.fail:
+            return False
+        self.batches.append(updates)
+        return True
+
+@pytest.fixture
+def wall():
+    return FakeWall()
+
+@pytest.fixture
+def comp(wall):
+    return Compositor(8, fps=30, send=wall.send, ready=lambda: True)
+
+def test_only_changed_pixels_are_sent(comp, wall):
+    comp.set_pixels("drawing", [[1, 255, 0, 0], [2, 0, 255, 0]])
+    assert comp.tick() == 2
+    assert wall.batches[-1] == [[1, 255, 0, 0], [2, 0, 255, 0]]
+
+    comp.set_pixels("drawing", [[2, 0, 255, 0], [3, 0, 0, 255]])  # Pixel 2 unchanged
+    assert comp.tick() == 1
+    assert wall.batches[-1] == [[3, 0, 0, 255]]
+
+    assert comp.tick() == 0  # Nothing dirty
+    assert len(wall.batches) == 2
+
+def test_opacity_and_blend_modes(comp, wall):
+    comp.fill("background", 100, 100, 100)
+    comp.set_pixels("drawing", [[0, 200, 0, 0]])
+    comp.configure("drawing", opacity=0.5)
+    comp.set_pixels("overlay", [[1, 100, 0, 0]])
+    comp.configure("overlay", blend="add")
+    comp.set_pixels("video", [[2, 128, 255, 0]])
+    comp.configure("video", blend="multiply")
+    comp.tick()
+    sent = {i: (r, g, b) for i, r, g, b in wall.batches[-1]}
+    assert sent[0] == (150, 50, 50)  # Halfway between grey and red
+    assert sent[1] == (200, 100, 100)  # Grey plus red
+    assert sent[2] == (50, 100, 0)  # Grey times (0.5, 1, 0)
+    assert sent[3] == (100, 100, 100)
+
+    comp.configure("drawing", visible=False)
+    comp.tick()
+    assert wall.batches[-1] == [[0, 100, 100, 100]]
+
+def test_recomposite_starts_at_lowest_dirty_layer(comp, wall):
+    comp.set_pixels("background", [[0, 50, 50, 50]])
+    comp.tick()
+    # Change the background behind the compositor's back: a change on a
+    # higher layer must reuse the cached composite of the layers below
+    comp.by_name["background"].rgb[0] = 1.0
+    comp.set_pixels("overlay", [[1, 10, 20, 30]])
+    comp.tick()
+    assert wall.batches[-1] == [[1, 10, 20, 30]]
+
+    comp.clear_layer("video")  # Layers above the background only
+    assert comp.tick() == 0
+
+    comp.configure("background", opacity=1.0)  # Background itself is dirty now
+    comp.tick()
+    assert wall.batches[-1] == [[0, 255, 255, 255]]
+
+def test_failed_send_is_retried(comp, wall):
+    comp.set_pixels("drawing", [[4, 1, 2, 3]])
+    wall.fail = True
+    assert comp.tick() == 0
+    assert not comp.sent.any()
+    wall.fail = False
+    assert comp.tick() == 1
+    assert wall.batches[-1] == [[4, 1, 2, 3]]
+
+def test_device_state_keeps_wall_until_a_layer_changes(comp, wall):
+    comp.fill("background", 100, 100, 100)
+    comp.device_state(100, 100, 100)
+    assert comp.tick() == 0  # Composite already matches the wall
+
+    comp.set_pixels("drawing", [[5, 255, 0, 0]])
+    assert comp.tick() == 1
+    assert wall.batches[-1] == [[5, 255, 0, 0]]
+
+def test_device_state_during_send_is_not_overwritten(comp, wall):
+    comp.set_pixels("drawing", [[0, 255, 0, 0]])
+    # A CLEAR lands while the batch is being written
+    wall.during_send = lambda: comp.device_state(0, 0, 0)
+    assert comp.tick() == 0
+    assert not comp.sent.any()  # The CLEAR record wins over the stale batch
+
+    wall.during_send = None
+    assert comp.tick() == 1  # Re-diffed against the cleared wall
+    assert wall.batches[-1] == [[0, 255, 0, 0]]
+
+def test_resume_restores_layers_after_mapping(comp, wall):
+    comp.set_pixels("drawing", [[1, 255, 0, 0], [5, 0, 0, 255]])
+    comp.tick()
+    comp.paused = True
+    comp.device_state(0, 0, 0)  # Mapping ends with all_off()
+    assert comp.tick() == 0
+    comp.resume()
+    assert comp.tick() == 2
+    assert wall.batches[-1] == [[1, 255, 0, 0], [5, 0, 0, 255]]
+
+def test_invalid_writes_raise(comp):
+    with pytest.raises(KeyError):
+        comp.set_pixels("nope", [[0, 1, 1, 1]])
+    with pytest.raises(ValueError):
+        comp.set_pixels("drawing", [[8, 1, 1, 1]])
+    with pytest.raises(ValueError):
+        comp.configure("drawing", blend="dodge")
+    assert np.array_equal(comp.sent, np.zeros((8, 3), dtype=np.uint8))
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import vision
+
+# 6 rows x 10 columns of LEDs, 40 px apart, in reference-camera pixels
+WALL = [(40.0 * col + 20, 40.0 * row + 20) for row in range(6) for col in range(10)]
+OFFSET = np.array([200.0, 0.0])  # Second camera sits 200 px further right
+
+def _expected(points):
+    """Wall positions normalized the same way merge_views does"""
+    pts = np.array(points)
+    lo = pts.min(axis=0)
+    size = np.maximum(pts.max(axis=0) - lo, 1.0)
+    lo -= size * 0.02
+    size *= 1.04
+    return (pts - lo) / size
+
+def _observe(sees_second):
+    observations = []
+    for i, (x, y) in enumerate(WALL):
+        obs = {}
+        if x < 200:
+            obs[0] = (x, y)
+        if sees_second(i, x, y):
+            obs[1] = tuple(np.array([x, y]) - OFFSET)
+        observations.append(obs)
+    return observations
+
+@pytest.mark.parametrize("overlap", ["patch", "one_row"])
+def test_merge_views_matches_wall(overlap):
+    if overlap == "patch":
+        # Columns at x=140 and x=180 of every row are seen by both cameras
+        observations = _observe(lambda i, x, y: x >= 140)
+    else:
+        # Only the first strip row crosses the overlap: shared LEDs are collinear
+        observations = _observe(lambda i, x, y: x >= 200 or (y == 20 and x >= 100))
+
+    coords, w, h, aligned = vision.merge_views(observations, 2)
+
+    assert aligned == [0, 1]
+    assert w == round((WALL[-1][0] - WALL[0][0]) * 1.04)
+    np.testing.assert_allclose(np.array(coords), _expected(WALL), atol=1e-6)
+
+def test_fit_affine_single_shared_led_is_translation():
+    M = vision._fit_affine(np.array([[10.0, 20.0]]), np.array([[15.0, 18.0]]))
+    np.testing.assert_allclose(vision._apply(M, (0.0, 0.0)), [5.0, -2.0])
@@ -0,0 +1,361 @@
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# --------------- Spot detection -------------
+def centroid_of_mask(mask: np.ndarray) -> Tuple[float, float]:
+    """Calculate centroid of a binary mask"""
+    M = cv2.moments(mask, binaryImage=True)
+    if M["m00"] == 0:
+        ys, xs = np.where(mask > 0)
+        if len(xs) == 0:
+            return (0.0, 0.0)
+        return (float(np.mean(xs)), float(np.mean(ys)))
+    cx = float(M["m10"] / M["m00"])
+    cy = float(M["m01"] / M["m00"])
+    return (cx, cy)
+
+def find_single_spot(gray_roi: np.ndarray, tolerance: int) -> Tuple[bool, Tuple[float, float]]:
+    """Find a single bright spot in the ROI"""
+    _, maxVal, _, _ = cv2.minMaxLoc(gray_roi)
+    thresh_val = max(0, maxVal - tolerance)
+    _, mask = cv2.threshold(gray_roi, thresh_val, 255, cv2.THRESH_BINARY)
+    mask = mask.astype(np.uint8)
+
+    num_labels, _ = cv2.connectedComponents(mask)
+    num_blobs = num_labels - 1  # background is 0
+    if num_blobs <= 0:
+        return False, (0.0, 0.0)
+    if num_blobs == 1:
+        cx, cy = centroid_of_mask(mask)
+        return True, (cx, cy)
+    return False, (0.0, 0.0)
+
+# --------------- Camera profile -------------
+# Applied in this order: format and size first since changing them can reset the rest
+_PROFILE_PROPS = [
+    ("fourcc", cv2.CAP_PROP_FOURCC),
+    ("width", cv2.CAP_PROP_FRAME_WIDTH),
+    ("height", cv2.CAP_PROP_FRAME_HEIGHT),
+    ("fps", cv2.CAP_PROP_FPS),
+    ("buffer_size", cv2.CAP_PROP_BUFFERSIZE),
+    ("auto_exposure", cv2.CAP_PROP_AUTO_EXPOSURE),
+    ("exposure", cv2.CAP_PROP_EXPOSURE),
+    ("gain", cv2.CAP_PROP_GAIN),
+    ("auto_wb", cv2.CAP_PROP_AUTO_WB),
+    ("wb_temperature", cv2.CAP_PROP_WB_TEMPERATURE),
+]
+# Manual exposure is 1 on V4L2 and 0.25 on DirectShow/MSMF
+_MANUAL_EXPOSURE = (1.0, 0.25)
+# Sensor cropping is only exposed as capture properties by the XIMEA backend
+_HW_ROI_PROPS = [
+    ("roi_width", cv2.CAP_PROP_XI_WIDTH),
+    ("roi_height", cv2.CAP_PROP_XI_HEIGHT),
+    ("roi_x", cv2.CAP_PROP_XI_OFFSET_X),
+    ("roi_y", cv2.CAP_PROP_XI_OFFSET_Y),
+]
+
+def _fourcc_str(value: float) -> str:
+    code = int(value)
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+
+def _set_verified(cap, prop: int, wanted) -> Tuple[bool, float]:
+    """Set a capture property and read it back; wanted may list backend alternatives"""
+    actual = 0.0
+    for value in wanted if isinstance(wanted, tuple) else (wanted,):
+        cap.set(prop, value)
+        actual = cap.get(prop)
+        if prop == cv2.CAP_PROP_FOURCC:
+            # Codes are packed characters, so nearby numbers are unrelated formats
+            if _fourcc_str(actual) == _fourcc_str(value):
+                return True, actual
+        elif abs(actual - value) <= max(0.5, abs(value) * 0.02):
+            return True, actual
+    return False, actual
+
+def apply_camera_profile(cap, profile: dict, roi: Optional[Tuple[float, float, float, float]] = None):
+    """Apply mapping capture settings and check which ones the camera accepted.
+
+    profile holds optional exposure, gain, wb_temperature, width, height,
+    fps, fourcc, buffer_size and hw_roi; None leaves a setting alone.
+    Setting exposure or wb_temperature turns the matching auto mode off.
+    roi is the normalized (x, y, w, h) to crop to on the sensor when hw_roi
+    is set. Returns (saved, report): saved is what restore_camera_profile
+    needs, report lists requested/actual/ok per setting plus the verified
+    frame size and measured frame rate.
+    """
+    wanted = {}
+    if profile.get("fourcc"):
+        wanted["fourcc"] = float(cv2.VideoWriter_fourcc(*profile["fourcc"][:4].ljust(4)))
+    for key in ("width", "height", "fps", "buffer_size", "gain"):
+        if profile.get(key) is not None:
+            wanted[key] = float(profile[key])
+    if profile.get("exposure") is not None:
+        wanted["auto_exposure"] = _MANUAL_EXPOSURE
+        wanted["exposure"] = float(profile["exposure"])
+    if profile.get("wb_temperature") is not None:
+        wanted["auto_wb"] = 0.0
+        wanted["wb_temperature"] = float(profile["wb_temperature"])
+
+    saved: List[Tuple[int, float]] = []
+    report = {}
+    for key, prop in _PROFILE_PROPS:
+        if key not in wanted:
+            continue
+        saved.append((prop, cap.get(prop)))
+        ok, actual = _set_verified(cap, prop, wanted[key])
+        requested = wanted[key][0] if isinstance(wanted[key], tuple) else wanted[key]
+        if key == "fourcc":
+            requested, actual = _fourcc_str(requested), _fourcc_str(actual)
+        report[key] = {"requested": requested, "actual": actual, "ok": ok}
+        if not ok:
+            print(f"⚠️ Camera ignored {key}={requested} (reads back {actual})")
+
+    # Size as actually delivered, checked before any sensor crop
+    ok, frame = cap.read()
+    if ok:
+        report["frame_size"] = [int(frame.shape[1]), int(frame.shape[0])]
+        for key, axis in (("width", 1), ("height", 0)):
+            if key in report:
+                report[key]["ok"] = report[key]["ok"] and frame.shape[axis] == int(wanted[key])
+
+    if ok and profile.get("hw_roi") and roi is not None:
+        H, W = frame.shape[:2]
+        crop = {
+            "roi_width": max(1, int(roi[2] * W)),
+            "roi_height": max(1, int(roi[3] * H)),
+            "roi_x": int(roi[0] * W),
+            "roi_y": int(roi[1] * H),
+        }
+        applied = []
+        for key, prop in _HW_ROI_PROPS:
+            applied.append((prop, cap.get(prop)))
+            ok_crop, _ = _set_verified(cap, prop, float(crop[key]))
+            if not ok_crop:
+                break
+        saved.extend(applied)
+        if ok_crop:
+            report["crop"] = {"x": crop["roi_x"], "y": crop["roi_y"], "w": crop["roi_width"], "h": crop["roi_height"], "sensor_w": W, "sensor_h": H}
+        else:
+            # Undo a partial crop and fall back to cropping in software
+            restore_camera_profile(cap, applied)
+            saved = saved[:len(saved) - len(applied)]
+            report["crop"] = None
+            print("Hardware ROI not supported by this camera backend; cropping in software")
+
+    # Rate actually achieved with these settings
+    start = time.time()
+    frames = 0
+    for _ in range(10):
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames += 1
+    elapsed = time.time() - start
+    report["measured_fps"] = round(frames / elapsed, 1) if frames and elapsed > 0 else None
+    return saved, report
+
+def restore_camera_profile(cap, saved: List[Tuple[int, float]]):
+    """Put back the capture settings saved by apply_camera_profile"""
+    for prop, value in reversed(saved):
+        cap.set(prop, value)
+
+# --------------- Shared frame buffers -------
+class FrameBuffer:
+    """Latest grayscale ROI frame of one camera, kept in shared memory.
+
+    The capture thread writes frames in place; detection processes attach by
+    name and copy out frames newer than a given sequence number. The sequence
+    counter is odd while a write is in progress. A second counter lets the
+    parent cancel detection tasks that are still watching the buffer.
+    """
+
+    HEADER = 16  # int64 sequence counter, int64 cancel counter
+
+    def __init__(self, shape: Tuple[int, int], name: Optional[str] = None):
+        self.shape = tuple(shape)
+        size = self.HEADER + self.shape[0] * self.shape[1]
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = _attach_shm(name)
+            self.owner = False
+        self._seq = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self._cancel = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf, offset=8)
+        self._frame = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=self.HEADER)
+        if self.owner:
+            self._seq[0] = 0
+            self._cancel[0] = 0
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def seq(self) -> int:
+        return int(self._seq[0]) // 2
+
+    @property
+    def cancel_gen(self) -> int:
+        return int(self._cancel[0])
+
+    def cancel(self):
+        """Stop detection tasks started before this call"""
+        self._cancel[0] += 1
+
+    def write(self, gray: np.ndarray):
+        self._seq[0] += 1
+        self._frame[:] = gray
+        self._seq[0] += 1
+
+    def read_newer(self, after_seq: int) -> Tuple[int, Optional[np.ndarray]]:
+        """Copy the current frame if it is newer than after_seq"""
+        s1 = int(self._seq[0])
+        if s1 % 2 or s1 // 2 <= after_seq:
+            return after_seq, None
+        frame = self._frame.copy()
+        if int(self._seq[0]) != s1:
+            return after_seq, None  # Overwritten while copying
+        return s1 // 2, frame
+
+    def close(self):
+        # Drop the numpy views before closing the mapping
+        del self._seq, self._cancel, self._frame
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def _attach_shm(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: pool processes share the parent's resource tracker,
+        # so the segment is still unlinked exactly once by its owner
+        return shared_memory.SharedMemory(name=name)
+
+# Buffers attached in this (pool) process, reused across detection tasks
+_ATTACHED: Dict[str, FrameBuffer] = {}
+
+def warm_up() -> bool:
+    """No-op task so pool processes start and import OpenCV before mapping begins"""
+    return True
+
+def detect_spot(buffer_name: str, shape: Tuple[int, int], after_seq: int, cancel_gen: int,
+                timeout: float, tolerance: int) -> Optional[Tuple[float, float]]:
+    """Watch one camera's frame buffer for a single spot; runs in a pool process.
+
+    Only frames captured after after_seq are considered. Returns the spot in
+    ROI pixel coordinates, or None if nothing was found before the timeout
+    or the buffer was cancelled past cancel_gen.
+    """
+    buf = _ATTACHED.get(buffer_name)
+    if buf is None:
+        buf = _ATTACHED[buffer_name] = FrameBuffer(shape, name=buffer_name)
+    deadline = time.time() + timeout
+    seq = after_seq
+    while time.time() < deadline and buf.cancel_gen == cancel_gen:
+        seq, gray = buf.read_newer(seq)
+        if gray is None:
+            time.sleep(0.002)
+            continue
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        ok, (cx, cy) = find_single_spot(gray, tolerance)
+        if ok:
+            return (cx, cy)
+    return None
+
+def release_buffer(buffer_name: str) -> bool:
+    """Detach a frame buffer from this pool process"""
+    buf = _ATTACHED.pop(buffer_name, None)
+    if buf is not None:
+        buf.close()
+    return True
+
+# --------------- Multi-view merging ---------
+# Shared LEDs whose spread across the line they form is below this fraction
+# of their spread along it are treated as collinear
+_COLLINEAR_RATIO = 0.05
+
+def _fit_similarity(src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """Rotation, uniform scale and translation (3x2) taking src points onto dst points"""
+    ms, md = src.mean(axis=0), dst.mean(axis=0)
+    a = (src[:, 0] - ms[0]) + 1j * (src[:, 1] - ms[1])
+    b = (dst[:, 0] - md[0]) + 1j * (dst[:, 1] - md[1])
+    c = np.vdot(a, b) / np.vdot(a, a).real  # Complex scale-rotation, least squares
+    R = np.array([[c.real, c.imag], [-c.imag, c.real]])
+    return np.vstack([R, md - ms @ R])
+
+def _fit_affine(src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """Least-squares 2D transform (3x2) taking src points onto dst points.
+
+    A full affine fit needs shared LEDs spread in two directions. When they
+    lie on one line (e.g. a single strip row crossing the overlap) the fit
+    is underdetermined, so fall back to a similarity, or to a translation
+    when they all coincide.
+    """
+    spread = np.linalg.svd(src - src.mean(axis=0), compute_uv=False) if len(src) >= 2 else np.zeros(2)
+    if spread[0] < 1.0:
+        # One shared point (or all at the same spot): translation only
+        return np.vstack([np.eye(2), (dst - src).mean(axis=0)])
+    if len(src) < 3 or spread[1] < _COLLINEAR_RATIO * spread[0]:
+        return _fit_similarity(src, dst)
+    A = np.hstack([src, np.ones((len(src), 1))])
+    M, *_ = np.linalg.lstsq(A, dst, rcond=None)
+    return M
+
+def _apply(M: np.ndarray, p: Tuple[float, float]) -> np.ndarray:
+    return np.array([p[0], p[1], 1.0]) @ M
+
+def merge_views(observations: List[Dict[int, Tuple[float, float]]], num_views: int):
+    """Merge per-camera LED observations into one coordinate space.
+
+    observations[i] maps view index -> (px, py) in that camera's pixels for
+    LED i. View 0 is the reference; every other view is aligned to views
+    already placed using the LEDs they both saw. Returns (coords, w, h,
+    aligned) where coords are normalized to the bounding box of all found
+    LEDs (0, 0 for LEDs no aligned view saw) and w, h are that box's size in
+    reference-camera pixels.
+    """
+    transforms = {0: np.vstack([np.eye(2), np.zeros(2)])}
+    pending = set(range(1, num_views))
+    progress = True
+    while pending and progress:
+        progress = False
+        for v in sorted(pending):
+            src, dst = [], []
+            for obs in observations:
+                if v not in obs:
+                    continue
+                placed = [_apply(transforms[u], p) for u, p in obs.items() if u in transforms]
+                if placed:
+                    src.append(obs[v])
+                    dst.append(np.mean(placed, axis=0))
+            if src:
+                transforms[v] = _fit_affine(np.array(src, dtype=float), np.array(dst, dtype=float))
+                pending.discard(v)
+                progress = True
+    if pending:
+        print(f"⚠️ Views {sorted(pending)} share no LEDs with the others and were left out")
+
+    points: List[Optional[np.ndarray]] = []
+    for obs in observations:
+        placed = [_apply(transforms[u], p) for u, p in obs.items() if u in transforms]
+        points.append(np.mean(placed, axis=0) if placed else None)
+
+    found = np.array([p for p in points if p is not None])
+    if len(found) == 0:
+        return [(0.0, 0.0)] * len(observations), 0, 0, sorted(transforms)
+    # Small margin keeps real LEDs off the (0, 0) "not found" marker
+    lo = found.min(axis=0)
+    size = np.maximum(found.max(axis=0) - lo, 1.0)
+    lo -= size * 0.02
+    size *= 1.04
+    coords = [
+        (0.0, 0.0) if p is None else (float((p[0] - lo[0]) / size[0]), float((p[1] - lo[1]) / size[1]))
+        for p in points
+    ]
+    return coords, int(round(size[0])), int(round(size[1])), sorted(transforms)